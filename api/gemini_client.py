@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+"""
+Gemini API 공용 클라이언트
+- API 설정 / 응답 캐시 / call_gemini 를 한 곳에서 관리 (모듈마다 중복 정의하지 않음)
+"""
+
+import os
+import re
+import json
+import time
+import random
+import sqlite3
+import hashlib
+import threading
+import requests
+from collections import OrderedDict
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+# ===== 환경 변수 / API 설정 =====
+load_dotenv()
+API_KEY = os.getenv("GEMINI_API_KEY")
+MODEL_NAME = "gemini-2.5-flash"
+API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/{MODEL_NAME}:generateContent?key={API_KEY}"
+CACHED_CONTENTS_URL = f"https://generativelanguage.googleapis.com/v1beta/cachedContents?key={API_KEY}"
+REQUEST_TIMEOUT = (5, 120)  # (연결, 읽기) 초 — 연결 실패는 빨리 재시도, 생성은 충분히 대기
+
+# ===== HTTP 세션 (TCP/TLS 연결 재사용) =====
+SESSION = requests.Session()
+SESSION.headers.update({"Content-Type": "application/json"})
+SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=32))
+
+# ===== 재시도 (일시적 오류: 408/429/5xx, 연결 실패/타임아웃) =====
+MAX_RETRIES = 4
+RETRY_BASE_DELAY = 1.0   # 초
+RETRY_MAX_DELAY = 16.0   # 초
+RETRYABLE_STATUS = frozenset({408, 429, 500, 502, 503, 504})
+
+def _retry_delay(attempt, response=None):
+    """지수 백오프 + full jitter (서버가 Retry-After 를 주면 그 값을 우선)"""
+    retry_after = response.headers.get("Retry-After", "") if response is not None else ""
+    if retry_after.isdigit():
+        return min(float(retry_after), RETRY_MAX_DELAY)
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+def _post_with_retry(data, url=API_URL):
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            response = SESSION.post(url, json=data, timeout=REQUEST_TIMEOUT)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == MAX_RETRIES:
+                raise
+            time.sleep(_retry_delay(attempt))
+            continue
+        if response.status_code not in RETRYABLE_STATUS or attempt == MAX_RETRIES:
+            return response
+        time.sleep(_retry_delay(attempt, response))
+
+# ===== 응답 캐시 (동일 프롬프트 재호출 방지) =====
+RESPONSE_CACHE_SIZE = 1024
+_response_cache = OrderedDict()
+_response_cache_lock = threading.Lock()
+
+def _generation_config(json_mode=False):
+    """요청에 실을 generationConfig (없으면 None)"""
+    return {"responseMimeType": "application/json"} if json_mode else None
+
+def _prompt_key(prompt, system_instruction=None, json_mode=False):
+    """모델/생성 설정/지시문/프롬프트 해시 — 모델이나 설정이 바뀌면 이전 응답을 재사용하지 않음"""
+    h = hashlib.blake2b(digest_size=16)
+    for part in (
+        MODEL_NAME,
+        json.dumps(_generation_config(json_mode), sort_keys=True),
+        system_instruction or "",
+        prompt,
+    ):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+def _remember(key, text):
+    with _response_cache_lock:
+        _response_cache[key] = text
+        if len(_response_cache) > RESPONSE_CACHE_SIZE:
+            _response_cache.popitem(last=False)
+
+# ===== 디스크 응답 캐시 (프로세스 재시작/배치 재실행 후에도 동일 프롬프트 재사용) =====
+# 사용자 대화/모델 응답 원문이 파일에 남으므로 기본은 꺼 둠
+# GEMINI_RESPONSE_CACHE_FILE 에 경로(예: .cache/gemini_responses.sqlite3)를 지정할 때만 사용
+RESPONSE_CACHE_DB = os.getenv("GEMINI_RESPONSE_CACHE_FILE", "")
+RESPONSE_CACHE_TTL = int(os.getenv("GEMINI_RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))  # 초
+_disk_cache = None
+_disk_cache_lock = threading.Lock()
+
+def _disk_cache_conn():
+    global _disk_cache
+    if _disk_cache is None:
+        os.makedirs(os.path.dirname(RESPONSE_CACHE_DB) or ".", exist_ok=True)
+        conn = sqlite3.connect(RESPONSE_CACHE_DB, check_same_thread=False)
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, created REAL NOT NULL, text TEXT NOT NULL)"
+            )
+            # 처음 열 때 TTL 지난 항목 정리 (파일이 계속 커지지 않도록)
+            conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - RESPONSE_CACHE_TTL,))
+        _disk_cache = conn
+    return _disk_cache
+
+def _disk_cache_get(key):
+    """TTL 안의 응답만 반환 (캐시 파일 문제는 캐시 미스로 취급)"""
+    if not RESPONSE_CACHE_DB:
+        return None
+    try:
+        with _disk_cache_lock:
+            row = _disk_cache_conn().execute(
+                "SELECT created, text FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+    except (OSError, sqlite3.Error):
+        return None
+    if row and time.time() - row[0] < RESPONSE_CACHE_TTL:
+        return row[1]
+    return None
+
+def _disk_cache_put(key, text):
+    if not RESPONSE_CACHE_DB:
+        return
+    try:
+        with _disk_cache_lock:
+            conn = _disk_cache_conn()
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)", (key, time.time(), text))
+    except (OSError, sqlite3.Error):
+        pass
+
+def _disk_cache_delete(key):
+    if not RESPONSE_CACHE_DB:
+        return
+    try:
+        with _disk_cache_lock:
+            conn = _disk_cache_conn()
+            with conn:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+    except (OSError, sqlite3.Error):
+        pass
+
+def forget_response(prompt, system_instruction=None, json_mode=False):
+    """
+    call_gemini 가 캐시해 둔 응답을 메모리/디스크에서 제거
+    - 호출 측 검증(JSON 파싱, 필수 필드 등)에 실패한 응답이 재시도 때 그대로 다시 나오지 않도록
+    """
+    key = _prompt_key(prompt, system_instruction, json_mode)
+    with _response_cache_lock:
+        _response_cache.pop(key, None)
+    _disk_cache_delete(key)
+
+# ===== 컨텍스트 캐시 (고정 systemInstruction 을 서버에 한 번 등록하고 이름으로 참조) =====
+CONTEXT_CACHE_TTL = 3600          # 초
+CONTEXT_CACHE_MARGIN = 60         # 만료 직전 이름을 쓰지 않도록 두는 여유 (초)
+CONTEXT_CACHE_RETRY_AFTER = 600   # 등록 일시 실패(타임아웃/5xx 등) 시 인라인 전송으로 버티는 시간 (초)
+CONTEXT_CACHE_REJECTED_TTL = 7 * 24 * 3600  # '최소 크기 미달'로 거절된 지시문을 다시 등록하지 않는 기간 (초)
+CONTEXT_CACHE_MIN_TOKENS = 1024   # gemini-2.5-flash 의 최소 캐시 토큰 수
+CONTEXT_CACHE_CREATE_TIMEOUT = (5, 30)  # 등록 요청은 재시도 없이 짧게
+# 등록된 이름과 '최소 크기 미달' 거절만 만료 시각과 함께 파일로 남겨 프로세스 재시작(배치 재실행) 후에도 재사용
+# (키 오류/일시 장애 등 다른 실패는 메모리에만 두어 원인이 고쳐지면 바로 다시 등록)
+CONTEXT_CACHE_STATE = os.getenv("GEMINI_CONTEXT_CACHE_FILE", os.path.join(".cache", "gemini_context_cache.json"))
+
+def _load_context_caches():
+    try:
+        with open(CONTEXT_CACHE_STATE, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        # 이름 없는 항목은 최소 크기 미달로 표시된 거절만 인정 (예전 형식의 다른 실패 기록은 버림)
+        return {
+            k: (v.get("name"), v["expire"])
+            for k, v in state.items() if v.get("name") or v.get("too_small")
+        }
+    except (OSError, ValueError, AttributeError, KeyError, TypeError):
+        return {}
+
+def _save_context_caches():
+    """만료되지 않은 항목 저장 (저장 실패는 무시 — 다음 실행에서 재등록될 뿐)"""
+    now = time.time()
+    state = {
+        k: {"name": name, "expire": expire} if name else {"name": None, "too_small": True, "expire": expire}
+        for k, (name, expire) in _context_caches.items() if expire > now
+    }
+    try:
+        os.makedirs(os.path.dirname(CONTEXT_CACHE_STATE) or ".", exist_ok=True)
+        with open(CONTEXT_CACHE_STATE, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+    except OSError:
+        pass
+
+_context_caches = _load_context_caches()  # 모델+지시문 해시 -> (cachedContent 이름 또는 None(최소 크기 미달), 만료 시각(epoch))
+_context_cache_retry_at = {}              # 일시 실패한 키 -> 다시 등록을 시도할 시각 (파일에 남기지 않음)
+_context_cache_pending = set()            # 지금 등록 요청 중인 키 (같은 지시문은 한 번만 등록)
+_context_cache_lock = threading.Lock()    # 위 자료구조 보호용 (네트워크 호출 중에는 잡지 않음)
+
+def _is_too_small_error(response):
+    """등록 거절 사유가 최소 토큰 수 미달인지 ('Cached content is too small. total_token_count=..., min_total_token_count=...')"""
+    if response.status_code != 400:
+        return False
+    body = response.text.lower()
+    return "too small" in body or "min_total_token_count" in body
+
+def _create_cached_content(system_instruction):
+    """
+    cachedContents 에 지시문 등록 -> (이름 또는 None, 최소 크기 미달 거절 여부)
+    - 잘못된 API 키 등 다른 400 은 지시문 문제가 아니므로 일시 실패와 같이 취급
+    """
+    data = {
+        "model": f"models/{MODEL_NAME}",
+        "systemInstruction": {"parts": [{"text": system_instruction}]},
+        "ttl": f"{CONTEXT_CACHE_TTL}s",
+    }
+    try:
+        response = SESSION.post(CACHED_CONTENTS_URL, json=data, timeout=CONTEXT_CACHE_CREATE_TIMEOUT)
+        if response.status_code != 200:
+            return None, _is_too_small_error(response)
+        return response.json().get("name"), False
+    except (requests.RequestException, ValueError):
+        return None, False
+
+def get_cached_content(system_instruction):
+    """
+    지시문에 대응하는 cachedContent 이름 (없거나 만료되면 재등록, 실패/등록 중이면 None → 인라인 전송)
+    - 등록 요청은 잠금 밖에서 키마다 한 스레드만 보냄, 다른 스레드는 기다리지 않고 인라인으로 진행
+    - 최소 토큰 수 충족 여부는 서버의 등록 응답으로 판단
+    """
+    # 토큰 하나는 UTF-8 1바이트 이상이므로, 바이트 수가 최소 토큰 수보다 적으면 확실히 미달 (요청 생략)
+    if len(system_instruction.encode("utf-8")) < CONTEXT_CACHE_MIN_TOKENS:
+        return None
+    key = _prompt_key("", system_instruction)
+    with _context_cache_lock:
+        now = time.time()
+        entry = _context_caches.get(key)
+        if entry and entry[1] > now:
+            return entry[0]
+        if _context_cache_retry_at.get(key, 0) > now or key in _context_cache_pending:
+            return None
+        _context_cache_pending.add(key)
+
+    name, too_small = None, False
+    try:
+        name, too_small = _create_cached_content(system_instruction)
+    finally:
+        with _context_cache_lock:
+            now = time.time()
+            _context_cache_pending.discard(key)
+            if name or too_small:
+                ttl = CONTEXT_CACHE_TTL - CONTEXT_CACHE_MARGIN if name else CONTEXT_CACHE_REJECTED_TTL
+                _context_caches[key] = (name, now + ttl)
+                _context_cache_retry_at.pop(key, None)
+                _save_context_caches()
+            else:
+                _context_cache_retry_at[key] = now + CONTEXT_CACHE_RETRY_AFTER
+    return name
+
+def _invalidate_cached_content(system_instruction):
+    with _context_cache_lock:
+        if _context_caches.pop(_prompt_key("", system_instruction), (None,))[0]:
+            _save_context_caches()
+
+def _is_cached_content_error(response):
+    """cachedContent 가 만료/삭제돼 거절된 응답인지 (요청 자체가 잘못된 400 등과 구분)"""
+    if response.status_code not in (400, 403, 404):
+        return False
+    body = response.text
+    return "cachedcontent" in body.lower() or "NOT_FOUND" in body
+
+def call_gemini(prompt, system_instruction=None, json_mode=False):
+    """
+    Gemini API 호출 함수 (정상 종료한 응답은 프롬프트 해시 기준으로 메모리 LRU + 디스크 캐시)
+    - system_instruction: 요청 간 공통인 고정 지시문 (cachedContent 로 등록해 참조, 실패 시 인라인 전송)
+    - json_mode: True 면 응답을 JSON 으로 강제 (responseMimeType=application/json, 코드 펜스/설명문 없음)
+    - 호출 측에서 응답을 쓸 수 없다고 판단하면 같은 인자로 forget_response 를 호출해 캐시에서 뺄 것
+    """
+    key = _prompt_key(prompt, system_instruction, json_mode)
+    with _response_cache_lock:
+        if key in _response_cache:
+            _response_cache.move_to_end(key)
+            return _response_cache[key]
+    text = _disk_cache_get(key)
+    if text is not None:
+        _remember(key, text)
+        return text
+
+    data = {
+        "contents": [{"parts": [{"text": prompt}]}]
+    }
+    generation_config = _generation_config(json_mode)
+    if generation_config:
+        data["generationConfig"] = generation_config
+    cached_name = get_cached_content(system_instruction) if system_instruction else None
+    if cached_name:
+        data["cachedContent"] = cached_name
+    elif system_instruction:
+        data["systemInstruction"] = {"parts": [{"text": system_instruction}]}
+    response = _post_with_retry(data)
+
+    # 서버 쪽 캐시가 먼저 만료/삭제된 경우: 항목을 버리고 지시문을 인라인으로 실어 한 번 더
+    if cached_name and _is_cached_content_error(response):
+        _invalidate_cached_content(system_instruction)
+        del data["cachedContent"]
+        data["systemInstruction"] = {"parts": [{"text": system_instruction}]}
+        response = _post_with_retry(data)
+
+    if response.status_code == 200:
+        try:
+            candidate = response.json()['candidates'][0]
+            text = candidate['content']['parts'][0]['text']
+        except Exception as e:
+            return f"[파싱 오류]: {e}"
+        # 정상 종료(STOP)한 응답만 캐시 — 길이 제한/안전 필터로 잘린 응답은 다음 호출에서 다시 생성
+        if candidate.get("finishReason") == "STOP":
+            _remember(key, text)
+            _disk_cache_put(key, text)
+        return text
+    else:
+        return f"[API 오류]: {response.status_code} - {response.text}"
+
+# ===== 응답 후처리 =====
+# ```json ... ``` / ``` ... ``` 블록 본문을 한 번의 스캔으로 추출 (닫는 펜스가 없으면 끝까지)
+_CODE_FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)(?:```|$)", re.DOTALL)
+
+def strip_code_fences(text):
+    """응답에서 코드 펜스를 벗겨 JSON 본문만 반환 (펜스가 없으면 원문 그대로)"""
+    m = _CODE_FENCE_RE.search(text)
+    return (m.group(1) if m else text).strip()
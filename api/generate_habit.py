@@ -1,58 +1,51 @@
 import os
 import json
-import requests
-from dotenv import load_dotenv
-
-load_dotenv()
-
-API_KEY = os.getenv("GEMINI_API_KEY")
-API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={API_KEY}"
-
-def call_gemini(prompt):
-    """Gemini API 호출 함수"""
-    headers = {"Content-Type": "application/json"}
-    data = {
-        "contents": [{"parts": [{"text": prompt}]}]
-    }
-    response = requests.post(API_URL, headers=headers, json=data)
-
-    if response.status_code == 200:
-        try:
-            return response.json()['candidates'][0]['content']['parts'][0]['text']
-        except Exception as e:
-            return f"[파싱 오류]: {e}"
-    else:
-        return f"[API 오류]: {response.status_code} - {response.text}"
-
-def build_habit_prompt(history, currentPrompt):
-    """습관 등록을 위한 프롬프트 생성"""
-    # history는 리스트 혹은 문자열일 수 있음
-    if isinstance(history, list):
-        history_text = "\n".join([f"- {item}" for item in history]) if history else "(없음)"
-    else:
-        history_text = str(history) if history else "(없음)"
-
-    current_text = str(currentPrompt) if currentPrompt is not None else ""
-
-    return f"""
-다음의 대화 history와 현재 발화(currentPrompt)를 모두 함께 고려하여 습관을 등록하세요. 필요한 정보가 부족하면 한 번에 모두 물어보도록 `ask`를 구성하세요.
-
+import asyncio
+import threading
+import orjson
+from concurrent.futures import ThreadPoolExecutor
+from api.gemini_client import API_KEY, call_gemini, forget_response, strip_code_fences
+
+def _env_concurrency(default: int = 8) -> int:
+    """WAVI_CONCURRENCY: 동시에 진행할 Gemini 호출 수 상한 (정수가 아니면 기본값, 최소 1)"""
+    try:
+        return max(1, int(os.getenv("WAVI_CONCURRENCY", str(default))))
+    except ValueError:
+        return default
+
+MAX_CONCURRENCY = _env_concurrency()
+
+# 프로세스 전체에서 공유하는 풀 — 동시 요청이 여러 개여도 Gemini 호출 수는 MAX_CONCURRENCY 를 넘지 않음
+# import 시점이 아니라 처음 사용할 때 생성
+_gemini_pool = None
+_gemini_pool_lock = threading.Lock()
+
+def _get_gemini_pool() -> ThreadPoolExecutor:
+    global _gemini_pool
+    with _gemini_pool_lock:
+        if _gemini_pool is None:
+            _gemini_pool = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY, thread_name_prefix="gemini")
+        return _gemini_pool
+
+# 습관 응답 필수 필드 (검증 순서 = 오류 메시지 우선순위)
+REQUIRED_HABIT_FIELDS = ("icon", "name", "start_time", "end_time", "day_of_week")
+
+# ===== 프롬프트 =====
+# 모든 요청에서 동일한 지시문/스키마/예시는 systemInstruction 으로 분리
+# (요청마다 달라지는 대화 내용만 본문으로 전송 → 고정 prefix 캐시 적중)
+HABIT_SYSTEM_INSTRUCTION = """
 당신은 습관 등록 전문가입니다. 사용자가 입력한 자연어 메시지를 분석하여 습관 정보를 구조화된 JSON 형태로 변환해주세요.
 
-**대화 History:**
-{history_text}
-
-**현재 발화(currentPrompt):**
-{current_text}
+다음의 대화 history와 현재 발화(currentPrompt)를 모두 함께 고려하여 습관을 등록하세요. 필요한 정보가 부족하면 한 번에 모두 물어보도록 `ask`를 구성하세요.
 
 **출력 형식 (JSON):**
-{{
+{
     "icon": "습관에 맞는 아이콘 (예: 💻, 🏃, 📚, 🎵, 🍎, 💪, 🧘, ☕, 🚶, 🎨)",
     "name": "습관 이름 (어떤 습관을 몇분/몇회 하겠다)",
     "start_time": 수행 가능 시작 시간 (HH:MM:SS 형식),
     "end_time": 수행 가능 종료 시간 (HH:MM:SS 형식),
     "day_of_week": [요일 배열 (1=월, 2=화, 3=수, 4=목, 5=금, 6=토, 7=일)]
-}}
+}
 
 **분석 가이드라인:**
 1. **icon**: 습관의 성격에 맞는 이모지 선택
@@ -83,13 +76,13 @@ def build_habit_prompt(history, currentPrompt):
 
 **예시:**
 - "매일 아침 9시에 코딩 1시간씩 하고 싶어"
-  → {{"icon": "💻", "name": "코딩 1시간", "start_time": "09:00:00", "end_time": "10:00:00", "day_of_week": [1, 2, 3, 4, 5, 6, 7]}}
+  → {"icon": "💻", "name": "코딩 1시간", "start_time": "09:00:00", "end_time": "10:00:00", "day_of_week": [1, 2, 3, 4, 5, 6, 7]}
 
 - "오전 9시~11시 사이에 코딩 1시간"
-  → {{"icon": "💻", "name": "코딩 1시간", "start_time": "09:00:00", "end_time": "11:00:00", "day_of_week": [1, 2, 3, 4, 5, 6, 7]}}
+  → {"icon": "💻", "name": "코딩 1시간", "start_time": "09:00:00", "end_time": "11:00:00", "day_of_week": [1, 2, 3, 4, 5, 6, 7]}
 
 - "월수금 저녁 7시~9시 사이에 운동 30분"
-  → {{"icon": "💪", "name": "운동 30분", "start_time": "19:00:00", "end_time": "21:00:00", "day_of_week": [1, 3, 5]}}
+  → {"icon": "💪", "name": "운동 30분", "start_time": "19:00:00", "end_time": "21:00:00", "day_of_week": [1, 3, 5]}
 
 **중요사항:**
 - 반드시 유효한 JSON 형식으로 출력
@@ -106,7 +99,25 @@ def build_habit_prompt(history, currentPrompt):
 
 **부족 정보 처리 예시:**
 - "코딩 1시간씩 하고 싶어"
-  → {{"icon": "💻", "name": "코딩 1시간", "start_time": null, "end_time": null, "day_of_week": null, "need_more_info": true, "ask": "수행 가능한 시간 범위(시작~종료 시간)와 요일을 알려주세요."}}
+  → {"icon": "💻", "name": "코딩 1시간", "start_time": null, "end_time": null, "day_of_week": null, "need_more_info": true, "ask": "수행 가능한 시간 범위(시작~종료 시간)와 요일을 알려주세요."}
+"""
+
+def build_habit_prompt(history, currentPrompt):
+    """습관 등록을 위한 프롬프트 생성 (사용자별 대화 부분만)"""
+    # history는 리스트 혹은 문자열일 수 있음
+    if isinstance(history, list):
+        history_text = "\n".join([f"- {item}" for item in history]) if history else "(없음)"
+    else:
+        history_text = str(history) if history else "(없음)"
+
+    current_text = str(currentPrompt) if currentPrompt is not None else ""
+
+    return f"""
+**대화 History:**
+{history_text}
+
+**현재 발화(currentPrompt):**
+{current_text}
 """
 
 def generate_habit_from_message(user_message):
@@ -120,12 +131,12 @@ def generate_habit_from_message(user_message):
             history = []
             current_prompt = user_message
 
-        prompt = build_habit_prompt(history, current_prompt)
-        response = call_gemini(prompt)
-        
-        # API 키 확인
+        # API 키 확인 (키 없이 네트워크 호출하지 않도록 먼저 검사)
         if not API_KEY:
             return {"error": "GEMINI_API_KEY가 설정되지 않았습니다. .env 파일을 확인해주세요."}
+
+        prompt = build_habit_prompt(history, current_prompt)
+        response = call_gemini(prompt, system_instruction=HABIT_SYSTEM_INSTRUCTION, json_mode=True)
         
         # 응답이 오류인지 확인
         if response.startswith("[API 오류]") or response.startswith("[파싱 오류]"):
@@ -133,35 +144,40 @@ def generate_habit_from_message(user_message):
         
         # JSON 파싱 시도
         try:
-            # 응답에서 JSON 부분만 추출
-            if "```json" in response:
-                json_start = response.find("```json") + 7
-                json_end = response.find("```", json_start)
-                json_str = response[json_start:json_end].strip()
-            elif "```" in response:
-                json_start = response.find("```") + 3
-                json_end = response.find("```", json_start)
-                json_str = response[json_start:json_end].strip()
-            else:
-                json_str = response.strip()
+            # 응답에서 JSON 부분만 추출 후 파싱
+            habit_data = orjson.loads(strip_code_fences(response))
             
-            # JSON 파싱
-            habit_data = json.loads(json_str)
-            
-            # 필수 필드 검증
-            required_fields = ["icon", "name", "start_time", "end_time", "day_of_week"]
-            for field in required_fields:
-                if field not in habit_data:
-                    return {"error": f"필수 필드 '{field}'가 누락되었습니다."}
+            # 필수 필드 검증 (쓸 수 없는 응답은 캐시에서 빼서 재시도 때 새로 생성되도록)
+            if not isinstance(habit_data, dict):
+                forget_response(prompt, HABIT_SYSTEM_INSTRUCTION, json_mode=True)
+                return {"error": "응답이 JSON 객체 형식이 아닙니다.", "raw_response": response}
+            missing = next((f for f in REQUIRED_HABIT_FIELDS if f not in habit_data), None)
+            if missing:
+                forget_response(prompt, HABIT_SYSTEM_INSTRUCTION, json_mode=True)
+                return {"error": f"필수 필드 '{missing}'가 누락되었습니다."}
             
             return habit_data
             
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
+            forget_response(prompt, HABIT_SYSTEM_INSTRUCTION, json_mode=True)
             return {"error": f"JSON 파싱 오류: {e}", "raw_response": response}
             
     except Exception as e:
         return {"error": f"습관 생성 중 오류가 발생했습니다: {str(e)}"}
 
+async def generate_habits_from_messages(messages):
+    """여러 메시지를 동시에 처리 (블로킹 Gemini 호출을 공유 스레드풀에서 병렬 실행)"""
+    loop = asyncio.get_running_loop()
+    pool = _get_gemini_pool()
+    results = [None] * len(messages)
+
+    # 긴 대화부터 먼저 제출 (긴 요청이 마지막에 꼬리 지연으로 남지 않도록), 결과는 입력 순서 유지
+    order = sorted(range(len(messages)), key=lambda i: len(str(messages[i])), reverse=True)
+    futures = [loop.run_in_executor(pool, generate_habit_from_message, messages[i]) for i in order]
+    for i, result in zip(order, await asyncio.gather(*futures)):
+        results[i] = result
+    return results
+
 def main():
     """테스트용 메인 함수"""
     # 테스트 입력들 (history + currentPrompt 형식)
@@ -201,10 +217,11 @@ def main():
     ]
     
     print("🧪 습관 등록 테스트 시작...\n")
-    
-    for i, message in enumerate(test_messages, 1):
+
+    results = asyncio.run(generate_habits_from_messages(test_messages))
+
+    for i, (message, result) in enumerate(zip(test_messages, results), 1):
         print(f"테스트 {i}: {json.dumps(message, ensure_ascii=False)}")
-        result = generate_habit_from_message(message)
         
         if "error" in result:
             print(f"❌ 오류: {result['error']}")
@@ -6,21 +6,35 @@
 """
 
 import os
-import json
 import re
-from datetime import datetime, timedelta
+import heapq
+import orjson
+from datetime import date, datetime
 from collections import Counter
-from dotenv import load_dotenv
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from operator import itemgetter
 
-# ===== 환경 변수 / 경로 설정 =====
-load_dotenv()
+# ===== 경로 설정 =====
 INPUT_DIR = "data"
 OUTPUT_DIRS = {
     "weekly": "outputs/weekly_report",
     "monthly": "outputs/monthly_report",
 }
-for _d in OUTPUT_DIRS.values():
-    os.makedirs(_d, exist_ok=True)
+_ensured_dirs = set()  # 이 프로세스에서 이미 만든 출력 폴더 (저장마다 makedirs 재호출 방지)
+
+def ensure_output_dir(path):
+    """출력 폴더를 처음 쓸 때 한 번만 생성 (import 시점에는 만들지 않음)"""
+    if path not in _ensured_dirs:
+        os.makedirs(path, exist_ok=True)
+        _ensured_dirs.add(path)
+    return path
+
+# ===== 입력 파일 스캔 =====
+def scan_json_files(input_dir):
+    """input_dir 안의 .json 파일 DirEntry 목록 (os.scandir 한 번으로 이름/경로/타입 확인)"""
+    with os.scandir(input_dir) as it:
+        return [e for e in it if e.name.endswith(".json") and e.is_file()]
 
 # ===== 꾸준함 지수 / 이모지 매핑 =====
 CONSISTENCY_THRESHOLDS = {"high": 70, "medium": 40}
@@ -33,125 +47,193 @@ REASON_ICON_MAP = {
     "기타 (직접 입력)": "💬",
 }
 
+# 프롬프트 톤(MAP prompt_type)별 응원 문장
+COURAGE_BY_TONE = {
+    "spark": "작은 행동에도 마음이 움직입니다. 오늘의 1분이 내일의 루틴으로 이어질 거예요.",
+    "facilitator": "시작은 언제나 작을수록 좋아요. 부담 없이 한 걸음만 내딛어봐요.",
+    "signal": "지금 흐름이 아주 좋아요. 이 느낌 그대로 이어가면 충분합니다.",
+}
+
 # ===== 자유입력 이모지 추론 =====
+# 위에서부터 처음 맞는 규칙의 이모지 (모듈 로드 시 한 번만 컴파일)
+EMOJI_RULES = [
+    (re.compile(r"(근육|통증|운동|피로|몸|스트레칭)"), "💪"),
+    (re.compile(r"(비|rain|장마|우산)"), "🌧️"),
+    (re.compile(r"(더움|hot|heat|폭염|덥)"), "☀️"),
+    (re.compile(r"(추움|cold|snow|한파|춥)"), "🥶"),
+    (re.compile(r"(피곤|졸|수면|컨디션|sleep|tired)"), "😴"),
+    (re.compile(r"(공부|시험|숙제|과제|project|work)"), "📚"),
+    (re.compile(r"(약속|친구|모임|행사|데이트|만남)"), "🧑‍🤝‍🧑"),
+    (re.compile(r"(지각|시간|늦|출근|등교)"), "⏰"),
+    (re.compile(r"(우울|기분|짜증|화|sad|depress)"), "😞"),
+]
+
+# 사유 문자열은 소수 어휘가 반복되므로 분류 결과를 캐시 (순수 함수)
+@lru_cache(maxsize=2048)
 def guess_emoji_from_text(text: str) -> str:
     t = (text or "").lower().strip()
-    if re.search(r"(근육|통증|운동|피로|몸|스트레칭)", t): return "💪"
-    if re.search(r"(비|rain|장마|우산)", t): return "🌧️"
-    if re.search(r"(더움|hot|heat|폭염|덥)", t): return "☀️"
-    if re.search(r"(추움|cold|snow|한파|춥)", t): return "🥶"
-    if re.search(r"(피곤|졸|수면|컨디션|sleep|tired)", t): return "😴"
-    if re.search(r"(공부|시험|숙제|과제|project|work)", t): return "📚"
-    if re.search(r"(약속|친구|모임|행사|데이트|만남)", t): return "🧑‍🤝‍🧑"
-    if re.search(r"(지각|시간|늦|출근|등교)", t): return "⏰"
-    if re.search(r"(우울|기분|짜증|화|sad|depress)", t): return "😞"
+    for pat, emoji in EMOJI_RULES:
+        if pat.search(t): return emoji
     return "💬"
 
 # ===== 시간 유틸 =====
-def parse_hhmm(s: str):
+def hhmm_to_min(s: str) -> int:
     """
-    입력: 'HH:MM' 또는 'HH:MM:SS' 모두 허용
-    반환: 오늘 날짜의 datetime (시간/분만 사용)
+    'HH:MM' 또는 'HH:MM:SS' -> 자정 기준 분 (초는 버림)
+    datetime 객체 없이 정수 연산만 사용 (자릿수가 모자란 '7:05' 도 허용)
     """
     t = (s or "").strip()
-    for fmt in ("%H:%M", "%H:%M:%S"):
-        try:
-            tm = datetime.strptime(t, fmt).time()
-            # seconds는 버리고 분 단위까지만 사용
-            tm = tm.replace(second=0, microsecond=0)
-            return datetime.combine(datetime.today().date(), tm)
-        except ValueError:
-            continue
-
-    # 여전히 실패하면 콜론 분해로 최후 시도
     try:
         parts = [int(p) for p in t.split(":")]
-        if len(parts) >= 2:
-            hh, mm = parts[0], parts[1]
-            return datetime.combine(datetime.today().date(),
-                                    datetime.strptime(f"{hh:02d}:{mm:02d}", "%H:%M").time())
-    except Exception:
-        pass
+    except ValueError:
+        parts = []
+    if len(parts) >= 2 and 0 <= parts[0] < 24 and 0 <= parts[1] < 60:
+        return parts[0] * 60 + parts[1]
     raise ValueError(f"Invalid time format: {s!r} (expected HH:MM or HH:MM:SS)")
 
+def min_to_hhmm(m: int) -> str:
+    """자정 기준 분 -> 'HH:MM' (24시간 넘어가면 다음 날로 넘김)"""
+    hh, mm = divmod(m % (24 * 60), 60)
+    return f"{hh:02d}:{mm:02d}"
+
 def normalize_hhmm(s: str) -> str:
     """'HH:MM' 또는 'HH:MM:SS' -> 항상 'HH:MM'"""
-    dt = parse_hhmm(s)
-    return dt.strftime("%H:%M")
+    return min_to_hhmm(hhmm_to_min(s))
 
 def minutes_between(start_hhmm: str, end_hhmm: str) -> int:
-    delta = parse_hhmm(end_hhmm) - parse_hhmm(start_hhmm)
-    return max(int(delta.total_seconds() // 60), 0)
+    return max(hhmm_to_min(end_hhmm) - hhmm_to_min(start_hhmm), 0)
 
 def add_minutes(hhmm: str, delta: int) -> str:
-    return (parse_hhmm(hhmm) + timedelta(minutes=delta)).strftime("%H:%M")
+    return min_to_hhmm(hhmm_to_min(hhmm) + delta)
 
-def extract_all_logs(logs):
-    """Return all logs without date filtering"""
-    return logs
+WEEKDAY_NAMES = ("월", "화", "수", "목", "금", "토", "일")  # weekday_of 인덱스 순서
 
-def minutes_filter_copy(habits):
-    """Copy habits with all logs, no date filtering"""
+@lru_cache(maxsize=4096)
+def weekday_of(date_str: str) -> int:
+    """
+    'YYYY-MM-DD' -> 요일 인덱스 (월=0 ... 일=6), 같은 날짜 문자열은 캐시 재사용
+    - 허용 범위는 strptime('%Y-%m-%d') 그대로 ('2025-1-5' 허용, '20250101' 거부)
+    - 0 을 채운 정확한 10자리 형식만 빠른 fromisoformat 으로 처리
+    """
+    if (len(date_str) == 10 and date_str[4] == "-" and date_str[7] == "-"
+            and date_str.isascii() and (date_str[:4] + date_str[5:7] + date_str[8:]).isdigit()):
+        return date.fromisoformat(date_str).weekday()
+    return datetime.strptime(date_str, "%Y-%m-%d").weekday()
+
+def select_active_habits(habits):
+    """
+    로그가 있는 습관만 선택 (집계 단계는 읽기만 하므로 원본 dict 를 그대로 사용)
+    - day_of_week 가 없으면 [] 로 채운 얕은 사본 (기존 복사본과 같은 기본값 유지)
+    """
     out = []
     for h in habits:
-        out.append({
-            "habit_id": h.get("habit_id"),
-            "name": h.get("name"),
-            "day_of_week": h.get("day_of_week", []),
-            "start_time": h.get("start_time"),
-            "end_time": h.get("end_time"),
-            "habit_log": extract_all_logs(h.get("habit_log", [])),
-        })
+        if not h.get("habit_log"): continue
+        if "day_of_week" not in h: h = {**h, "day_of_week": []}
+        out.append(h)
     return out
 
 # ===== 실패 사유 정규화 =====
+# 패턴은 import 시 한 번만 컴파일 (사유 문자열마다 re 캐시 조회를 반복하지 않도록)
 CATEGORY_RULES = [
-    (r"(의욕|동기|하기\s*싫|미루|귀찮|의지\s*부족)", "의지 부족"),
-    (r"(피곤|수면|졸림|늦잠|알람|컨디션|감기|통증|과로)", "건강 문제"),
-    (r"(과도|무리|버겁|부담|강도\s*높|시간\s*길|빡세)", "과도한 목표 설정"),
-    (r"(시간\s*부족|바쁨|업무|과제|시험|마감|출근|등교)", "시간 부족"),
-    (r"(일정\s*충돌|외출|약속|모임|여행|주말|공휴일)", "일정 충돌"),
-    (r"(날씨|더움|추움|비|폭염|폭우|한파|우울|기분|짜증|화)", "기타 (직접 입력)"),
+    (re.compile(r"(의욕|동기|하기\s*싫|미루|귀찮|의지\s*부족)"), "의지 부족"),
+    (re.compile(r"(피곤|수면|졸림|늦잠|알람|컨디션|감기|통증|과로)"), "건강 문제"),
+    (re.compile(r"(과도|무리|버겁|부담|강도\s*높|시간\s*길|빡세)"), "과도한 목표 설정"),
+    (re.compile(r"(시간\s*부족|바쁨|업무|과제|시험|마감|출근|등교)"), "시간 부족"),
+    (re.compile(r"(일정\s*충돌|외출|약속|모임|여행|주말|공휴일)"), "일정 충돌"),
+    (re.compile(r"(날씨|더움|추움|비|폭염|폭우|한파|우울|기분|짜증|화)"), "기타 (직접 입력)"),
 ]
+
+@lru_cache(maxsize=2048)
 def normalize_reason_category(text: str) -> str:
     t = (text or "").lower().strip()
     for pat, label in CATEGORY_RULES:
-        if re.search(pat, t):
+        if pat.search(t):
             return label
     return "기타 (직접 입력)"
 
+@lru_cache(maxsize=2048)
+def reason_icon(text: str):
+    """사유 -> (정규화 라벨, 아이콘): 알려진 라벨은 고정 매핑, '기타'만 자유입력 이모지 추론"""
+    norm = normalize_reason_category(text)
+    if norm == "기타 (직접 입력)":
+        return norm, guess_emoji_from_text(text)
+    return norm, REASON_ICON_MAP.get(norm, "💬")
+
 # ===== 지수 계산 =====
-def compute_overall_success_rate(habits):
-    total, success = 0, 0
+def collect_stats(habits):
+    """
+    로그를 한 번만 순회하며 지수/실패 사유/MAP/요일 패턴 집계를 모두 계산
+    - per_habit: 습관별 (전체 기록 수, 성공 수)
+    - fail_counts: 습관별 ({사유 라벨: 횟수}, {기타 사유 원문: 횟수})
+    - fail_labels: 전체 사유 라벨 Counter
+    - weekday_total / weekday_success: 요일별 기록 수 / 성공 수
+    """
+    per_habit, fail_counts = [], []
+    fail_labels, weekday_total, weekday_success = Counter(), Counter(), Counter()
     for h in habits:
         logs = h.get("habit_log", [])
-        total += len(logs)
-        success += sum(1 for l in logs if l.get("completed"))
+        success, counts, user_texts = 0, {}, {}
+        for log in logs:
+            done = log.get("completed")
+            try: day = weekday_of(log["date"])
+            except Exception: day = None
+            if day is not None:
+                weekday_total[day] += 1
+                if done: weekday_success[day] += 1
+            if done:
+                success += 1
+                continue
+            for raw in (log.get("failure_reason") or []):
+                label = normalize_reason_category(raw)
+                counts[label] = counts.get(label, 0) + 1
+                if label == "기타 (직접 입력)":
+                    t = raw.strip()
+                    user_texts[t] = user_texts.get(t, 0) + 1
+        per_habit.append((len(logs), success))
+        fail_counts.append((counts, user_texts))
+        fail_labels.update(counts)
+    return {
+        "per_habit": per_habit,
+        "fail_counts": fail_counts,
+        "fail_labels": fail_labels,
+        "weekday_total": weekday_total,
+        "weekday_success": weekday_success,
+    }
+
+def compute_overall_success_rate(habits, habit_stats=None):
+    """habit_stats: collect_stats(...)["per_habit"] — 습관별 (전체 기록 수, 성공 수) 목록 (없으면 여기서 집계)"""
+    habit_stats = habit_stats if habit_stats is not None else collect_stats(habits)["per_habit"]
+    total = sum(t for t, _ in habit_stats)
+    success = sum(s for _, s in habit_stats)
     return (success / total * 100) if total else 0.0
 
-def consistency_level_from_rate(rate):
-    if rate >= CONSISTENCY_THRESHOLDS["high"]: return "높음"
-    if rate >= CONSISTENCY_THRESHOLDS["medium"]: return "보통"
-    return "낮음"
+# (하한, 레벨, 아이콘) — 위에서부터 처음 만족하는 구간 사용
+_LEVEL_TABLE = (
+    (CONSISTENCY_THRESHOLDS["high"], "높음", "🔥"),
+    (CONSISTENCY_THRESHOLDS["medium"], "보통", "🙂"),
+    (float("-inf"), "낮음", "🌧️"),
+)
+
+def consistency_level_and_message(rate):
+    """성공률 -> (레벨, '꾸준함 지수: 레벨 아이콘' 표시 문구)"""
+    for threshold, level, icon in _LEVEL_TABLE:
+        if rate >= threshold:
+            return level, f"꾸준함 지수: {level} {icon}"
 
 # ===== 실패 사유 집계 =====
-def compute_per_habit_top_failure_reasons(active_habits, topk=2):
+def compute_per_habit_top_failure_reasons(active_habits, topk=2, fail_counts=None):
+    """fail_counts: collect_stats(...)["fail_counts"] (없으면 여기서 집계)"""
+    if fail_counts is None:
+        fail_counts = collect_stats(active_habits)["fail_counts"]
     result = []
-    for h in active_habits:
+    for h, (counts, user_texts) in zip(active_habits, fail_counts):
         hid = h.get("habit_id")
         name = h.get("name") or ""
-        logs = h.get("habit_log", [])
-        counter, user_texts = Counter(), []
-        for log in logs:
-            if log.get("completed"): continue
-            for raw in (log.get("failure_reason") or []):
-                label = normalize_reason_category(raw)
-                counter[label] += 1
-                if label == "기타 (직접 입력)": user_texts.append(raw.strip())
-        top_labels = [lbl for lbl, _ in counter.most_common(topk)]
+        # nlargest 는 동점일 때 먼저 나온 라벨 우선 (Counter.most_common 과 같은 순서)
+        top_labels = [lbl for lbl, _ in heapq.nlargest(topk, counts.items(), key=itemgetter(1))]
         final_reasons = []
         if "기타 (직접 입력)" in top_labels and user_texts:
-            user_texts = [t for t, _ in Counter(user_texts).most_common(topk)]
+            user_texts = [t for t, _ in heapq.nlargest(topk, user_texts.items(), key=itemgetter(1))]
             for lbl in top_labels:
                 if lbl == "기타 (직접 입력)": final_reasons.extend(user_texts)
                 else: final_reasons.append(lbl)
@@ -159,35 +241,20 @@ def compute_per_habit_top_failure_reasons(active_habits, topk=2):
             final_reasons = top_labels[:topk]
         reasons = []
         for r in final_reasons:
-            norm = normalize_reason_category(r)
-            icon = guess_emoji_from_text(r) if norm == "기타 (직접 입력)" else REASON_ICON_MAP.get(norm, "💬")
-            reasons.append({"reason": r, "icon": icon})
+            reasons.append({"reason": r, "icon": reason_icon(r)[1]})
         result.append({"habit_id": hid, "name": name, "reasons": reasons})
     return result
 
 # ===== MAP 진단 유틸 (요약 카피용, 최소 변경) =====
-def _collect_fail_labels_from_habits(habits):
-    labels = []
-    total, success = 0, 0
-    for h in habits:
-        logs = h.get("habit_log", [])
-        total += len(logs)
-        success += sum(1 for l in logs if l.get("completed"))
-        for l in logs:
-            if l.get("completed"):
-                continue
-            for raw in (l.get("failure_reason") or []):
-                labels.append(normalize_reason_category(raw))
-    rate = (success / total) if total else 0.0
-    return labels, rate
-
-def infer_overall_map_state(habits, overall_rate: float):
+def infer_overall_map_state(habits, overall_rate: float, fail_labels=None):
     """
     habits와 전체 성공률로 동기/능력 상태를 간단히 추정해
     요약 카피 톤을 결정(spark/facilitator/signal)하는 휴리스틱.
+    - fail_labels: collect_stats(...)["fail_labels"] (없으면 habits 에서 다시 수집)
     """
-    labels, _ = _collect_fail_labels_from_habits(habits)
-    c = Counter(labels)
+    if fail_labels is None:
+        fail_labels = collect_stats(habits)["fail_labels"]
+    c = fail_labels
 
     # Ability 낮음 신호: 시간/일정/과도 목표
     ability_low = c["시간 부족"] + c["일정 충돌"] + c["과도한 목표 설정"]
@@ -215,14 +282,17 @@ def flatten_reasons_from_top_fail(failure_data):
             if isinstance(r, list) and r: out.append(r[0])
     return out
 
-def generate_summary(nickname, habits, failure_data, rate):
+def generate_summary(nickname, habits, failure_data, rate, stats=None):
     """
     주간/월간 공통 summary 생성
     - success_rate(전체 꾸준함 지수) + B=MAP(프롬프트 톤) 반영 카피
+    - stats: collect_stats(habits) 결과 (없으면 여기서 집계)
     - 출력: {consistency, failure_reasons, daily_pattern, courage}
     """
+    stats = stats if stats is not None else collect_stats(habits)
+
     # MAP 상태 추정(요약 카피 톤 결정)
-    map_state = infer_overall_map_state(habits, rate)  # {'motivation','ability','prompt_type'}
+    map_state = infer_overall_map_state(habits, rate, stats["fail_labels"])  # {'motivation','ability','prompt_type'}
     pt = map_state["prompt_type"]
 
     # 1️⃣ 꾸준함 문장 (+ 프롬프트 톤 꼬리문장)
@@ -236,12 +306,10 @@ def generate_summary(nickname, habits, failure_data, rate):
     all_reasons = flatten_reasons_from_top_fail(failure_data)
     if all_reasons:
         most_common, _ = Counter(all_reasons).most_common(1)[0]
-        norm = normalize_reason_category(most_common)
+        norm, icon = reason_icon(most_common)
         if norm == "기타 (직접 입력)":
-            icon = guess_emoji_from_text(most_common)
             failure_reasons = f"{icon} 직접 입력된 사유가 많았어요. 예: \"{most_common}\""
         else:
-            icon = REASON_ICON_MAP.get(norm, "💬")
             failure_reasons = f"가장 자주 등장한 방해 요인은 {icon} '{most_common}'이에요."
         # Ability 낮음(퍼실리테이터)일 땐 '가벼운 대안'을 짧게 제안
         if pt == "facilitator":
@@ -249,30 +317,18 @@ def generate_summary(nickname, habits, failure_data, rate):
     else:
         failure_reasons = "이번 기간은 큰 방해 없이 잘 이어졌어요."
 
-    # 3️⃣ 요일 패턴 (그대로)
-    weekday_success, weekday_total = Counter(), Counter()
-    for h in habits:
-        for log in h.get("habit_log", []):
-            try: day = datetime.strptime(log["date"], "%Y-%m-%d").weekday()
-            except Exception: continue
-            weekday_total[day] += 1
-            if log.get("completed"): weekday_success[day] += 1
-
+    # 3️⃣ 요일 패턴 (collect_stats 에서 함께 집계)
+    weekday_success, weekday_total = stats["weekday_success"], stats["weekday_total"]
     if weekday_total:
         rate_by_day = {d: weekday_success[d] / weekday_total[d] for d in weekday_total}
         best_day = max(rate_by_day, key=rate_by_day.get)
         worst_day = min(rate_by_day, key=rate_by_day.get)
-        days = ["월", "화", "수", "목", "금", "토", "일"]
-        daily_pattern = f"{days[best_day]}요일엔 리듬이 좋고, {days[worst_day]}요일엔 약간 느슨했어요."
+        daily_pattern = f"{WEEKDAY_NAMES[best_day]}요일엔 리듬이 좋고, {WEEKDAY_NAMES[worst_day]}요일엔 약간 느슨했어요."
     else:
         daily_pattern = "요일별 패턴을 확인할 데이터가 부족했어요."
 
     # 4️⃣ 응원 문장(프롬프트 톤별 카피)
-    courage = {
-        "spark": "작은 행동에도 마음이 움직입니다. 오늘의 1분이 내일의 루틴으로 이어질 거예요.",
-        "facilitator": "시작은 언제나 작을수록 좋아요. 부담 없이 한 걸음만 내딛어봐요.",
-        "signal": "지금 흐름이 아주 좋아요. 이 느낌 그대로 이어가면 충분합니다."
-    }[pt]
+    courage = COURAGE_BY_TONE[pt]
 
     return {
         "consistency": consistency,
@@ -282,13 +338,12 @@ def generate_summary(nickname, habits, failure_data, rate):
     }
 
 # ===== recommendation 생성 (원본 유지) =====
-def generate_recommendations(habits):
+def generate_recommendations(habits, habit_stats=None):
+    """habit_stats: collect_stats(...)["per_habit"] (없으면 여기서 집계)"""
+    habit_stats = habit_stats if habit_stats is not None else collect_stats(habits)["per_habit"]
     recs = []
-    for h in habits:
-        logs = h.get("habit_log", [])
-        total = len(logs)
-        fails = sum(1 for l in logs if not l.get("completed"))
-        rate = (total - fails) / total * 100 if total else 0
+    for h, (total, success) in zip(habits, habit_stats):
+        rate = success / total * 100 if total else 0
         start, end = h.get("start_time") or "07:00", h.get("end_time") or "07:30"
         name = h.get("name") or "습관"
         if rate < 50:
@@ -309,39 +364,71 @@ def generate_recommendations(habits):
     return recs
 
 # ===== 메인 =====
+def process_one(path):
+    """
+    입력 파일 하나로 리포트 생성 (프로세스 풀 작업 단위)
+    - 반환: (저장 경로, 리포트 JSON bytes, 완료 메시지), 활성 습관이 없으면 None
+    - 저장은 main 이 입력 순서대로 하므로 같은 경로로 가는 파일이 여러 개면 항상 뒤쪽 파일이 남음
+    """
+    with open(path, "rb") as f:
+        data = orjson.loads(f.read())
+    user_id, nickname = data["user_id"], data.get("nickname", str(data["user_id"]))
+    report_type = (data.get("type") or "monthly").lower()
+    if report_type not in ("weekly", "monthly"): report_type = "monthly"
+    output_dir = OUTPUT_DIRS[report_type]
+    habits_all = data.get("habits", [])
+    active_habits = select_active_habits(habits_all)
+    if not active_habits: return None
+    parsed = {}
+
+    # 공통 구성요소 (weekly/monthly 동일) — 로그 집계는 collect_stats 한 번으로
+    stats = collect_stats(active_habits)
+    top_fail = compute_per_habit_top_failure_reasons(active_habits, 2, stats["fail_counts"])
+    parsed["top_failure_reasons"] = top_fail
+
+    rate = compute_overall_success_rate(active_habits, stats["per_habit"])
+    level, display_message = consistency_level_and_message(rate)
+    parsed["consistency_index"] = {
+        "success_rate": round(rate, 1),
+        # "level": level,
+        # "thresholds": CONSISTENCY_THRESHOLDS,
+        "display_message": display_message
+    }
+
+    parsed["summary"] = generate_summary(nickname, active_habits, top_fail, rate, stats)
+    parsed["recommendation"] = generate_recommendations(active_habits, stats["per_habit"])
+
+    out_path = os.path.join(output_dir, f"user_{user_id}_{nickname}_{report_type}_report.json")
+    return out_path, orjson.dumps(parsed, option=orjson.OPT_INDENT_2), f"✅ {nickname} {report_type} 리포트 저장 완료"
+
+def write_report(out_path, body):
+    """
+    같은 폴더의 임시 파일에 다 쓴 뒤 교체 — 중간에 죽어도 반쯤 쓰인 리포트가 남지 않음
+    - 교체 전에 fsync 로 내용을 디스크에 내려, 크래시 후 이름만 바뀐 빈 파일이 남지 않도록
+    """
+    ensure_output_dir(os.path.dirname(out_path))
+    tmp_path = f"{out_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(body)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, out_path)
+    except BaseException:
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+        raise
+
 def main():
-    for filename in os.listdir(INPUT_DIR):
-        if not filename.endswith(".json"): continue
-        path = os.path.join(INPUT_DIR, filename)
-        data = json.load(open(path, "r", encoding="utf-8"))
-        user_id, nickname = data["user_id"], data.get("nickname", str(data["user_id"]))
-        report_type = (data.get("type") or "monthly").lower()
-        if report_type not in ("weekly", "monthly"): report_type = "monthly"
-        output_dir = OUTPUT_DIRS[report_type]
-        habits_all = data.get("habits", [])
-        active_habits = [h for h in minutes_filter_copy(habits_all) if h.get("habit_log")]
-        if not active_habits: continue
-        parsed = {}
-
-        # 공통 구성요소 (weekly/monthly 동일)
-        top_fail = compute_per_habit_top_failure_reasons(active_habits, 2)
-        parsed["top_failure_reasons"] = top_fail
-
-        rate = compute_overall_success_rate(active_habits)
-        level = consistency_level_from_rate(rate)
-        parsed["consistency_index"] = {
-            "success_rate": round(rate, 1),
-            # "level": level,
-            # "thresholds": CONSISTENCY_THRESHOLDS,
-            "display_message": f"꾸준함 지수: {level}" + (" 🔥" if level=="높음" else (" 🙂" if level=="보통" else " 🌧️"))
-        }
-
-        parsed["summary"] = generate_summary(nickname, active_habits, top_fail, rate)
-        parsed["recommendation"] = generate_recommendations(active_habits)
-
-        os.makedirs(output_dir, exist_ok=True)
-        json.dump(parsed, open(os.path.join(output_dir, f"user_{user_id}_{nickname}_{report_type}_report.json"), "w", encoding="utf-8"), ensure_ascii=False, indent=2)
-        print(f"✅ {nickname} {report_type} 리포트 저장 완료")
+    # 파일마다 독립적인 CPU 작업(정규식/집계)이라 프로세스 풀로 GIL 없이 병렬 처리
+    # 저장은 이 프로세스에서 입력 순서대로 — 같은 리포트 경로는 항상 뒤쪽 파일이 이김 (기존 순차 처리와 동일)
+    paths = [entry.path for entry in scan_json_files(INPUT_DIR)]
+    if not paths: return
+    with ProcessPoolExecutor(max_workers=min(os.cpu_count() or 1, len(paths))) as ex:
+        for report in ex.map(process_one, paths):
+            if report is None: continue
+            out_path, body, message = report
+            write_report(out_path, body)
+            print(message)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
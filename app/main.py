@@ -8,26 +8,36 @@
 # ------------------------------------------------------------
 
 from typing import List, Optional, Dict, Any
-from datetime import datetime, timedelta
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel, Field
-import os, json
-from collections import Counter
+from fastapi import FastAPI, HTTPException, Header
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field, TypeAdapter
+import os
+import re
+import asyncio
+import time
+import hashlib
+import orjson
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 # ===== generate_report.py에서 필요한 함수 =====
 from api.generate_report import (
-    minutes_filter_copy,
+    select_active_habits,
     compute_per_habit_top_failure_reasons,
     compute_overall_success_rate,
-    consistency_level_from_rate,
+    consistency_level_and_message,
     generate_recommendations,
-    normalize_reason_category,
-    REASON_ICON_MAP,
-    guess_emoji_from_text
+    collect_stats,
+    scan_json_files,
+    WEEKDAY_NAMES,
+    COURAGE_BY_TONE,
+    reason_icon,
+    infer_overall_map_state,
 )
 
 INPUT_DIR = "data"
-app = FastAPI(title="Unified Habit Report API", version="3.1.0")
+app = FastAPI(title="Unified Habit Report API", version="3.1.0", default_response_class=ORJSONResponse)
 
 # ===================== Pydantic 모델 =====================
 class HabitLog(BaseModel):
@@ -73,6 +83,9 @@ class GenerateRunResponseItem(BaseModel):
 class GenerateRunResponse(BaseModel):
     results: List[GenerateRunResponseItem]
 
+# 응답 직렬화용 어댑터 (모듈 로드 시 한 번만 생성, dict 를 거치지 않고 바로 JSON bytes 로)
+_ITEM_ADAPTER = TypeAdapter(GenerateRunResponseItem)
+
 
 # ===================== 내부 유틸 =====================
 def _calc_period_by_type(report_type: str):
@@ -80,55 +93,89 @@ def _calc_period_by_type(report_type: str):
     report_type = (report_type or "monthly").lower()
     return "", "", 0
 
+# data/ 파일 파싱 결과 캐시 (LRU): path -> ((mtime_ns, size), dict)
+# 파일이 많아도 메모리가 무한히 늘지 않도록 최근 PAYLOAD_CACHE_SIZE 개만 유지
+PAYLOAD_CACHE_SIZE = 256
+_payload_cache = OrderedDict()
+# 풀 워커(쓰기)와 /reports/run 의 정리 루프(순회/삭제)가 동시에 접근하므로 잠금
+_payload_cache_lock = threading.Lock()
+
+def _load_payload(path: str) -> Dict[str, Any]:
+    """
+    파일이 바뀌지 않았으면(mtime/size 동일) 이전 파싱 결과를 재사용
+    - data/ 파일은 스키마 검증 없이 dict 로 (type 소문자/누락, nickname 누락 등은 _generate_for_bundle 에서 보정)
+    """
+    st = os.stat(path)
+    sig = (st.st_mtime_ns, st.st_size)
+    with _payload_cache_lock:
+        cached = _payload_cache.get(path)
+        if cached is not None and cached[0] == sig:
+            _payload_cache.move_to_end(path)
+            return cached[1]
+    with open(path, "rb") as f:
+        bundle = orjson.loads(f.read())
+    with _payload_cache_lock:
+        _payload_cache[path] = (sig, bundle)
+        _payload_cache.move_to_end(path)
+        if len(_payload_cache) > PAYLOAD_CACHE_SIZE:
+            _payload_cache.popitem(last=False)
+    return bundle
+
+def _load_one(path: str):
+    """(bundle dict, None) 또는 읽기/파싱 실패 시 (None, 오류 메시지)"""
+    try:
+        return _load_payload(path), None
+    except (OSError, orjson.JSONDecodeError) as e:
+        return None, str(e)
+
+def _error_item(name: str, error: str) -> GenerateRunResponseItem:
+    """/reports/run 에서 실패한 파일 자리에 넣는 항목"""
+    return GenerateRunResponseItem.model_construct(
+        user_id=-1, nickname=name, type="unknown",
+        top_failure_reasons=[], consistency_index={},
+        summary={}, recommendation=[], error=error
+    )
+
+# /reports/generate 응답 캐시: 요청 본문 해시 -> 직렬화된 응답 (동일 본문 재요청/재시도 시 재계산 생략)
+GENERATE_CACHE_SIZE = 256
+_generate_cache = OrderedDict()
+_generate_cache_lock = threading.Lock()
+
+def _payload_key(payload: UserPayload) -> str:
+    return hashlib.blake2b(payload.model_dump_json().encode("utf-8"), digest_size=16).hexdigest()
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    etag = etag.removeprefix("W/")
+    return "*" in tags or any(t.removeprefix("W/") == etag for t in tags)
+
+# 'H:M' / 'HH:MM' / 'HH:MM:SS' (strptime 의 %H:%M[:%S] 와 같은 허용 범위) — 예외 없이 한 번에 판별
+_TIME_RE = re.compile(r"(2[0-3]|[01]\d|\d):([0-5]\d|\d)(?::(?:[0-5]\d|\d))?")
+
 def _normalize_times_in_habits(habits: List[dict]) -> List[dict]:
+    """start_time/end_time 을 'HH:MM' 으로 정규화 (바뀌는 습관만 얕은 복사)"""
     normed = []
     for h in habits or []:
-        h2 = dict(h)
+        h2 = h
         for key in ("start_time", "end_time"):
-            val = h2.get(key)
+            val = h.get(key)
             if isinstance(val, str):
-                t = val.strip()
-                for fmt in ("%H:%M", "%H:%M:%S"):
-                    try:
-                        dt = datetime.strptime(t, fmt)
-                        h2[key] = dt.strftime("%H:%M")
-                        break
-                    except ValueError:
-                        continue
+                m = _TIME_RE.fullmatch(val.strip())
+                if m:
+                    hhmm = f"{int(m[1]):02d}:{int(m[2]):02d}"
+                    if hhmm != val:
+                        if h2 is h: h2 = dict(h)
+                        h2[key] = hhmm
         normed.append(h2)
     return normed
 
 
-# ===== 간단한 MAP 상태 추정 (generate_summary 대체) =====
-def _infer_overall_map_state(habits, rate: float):
-    labels = []
-    total, success = 0, 0
-    for h in habits:
-        logs = h.get("habit_log", [])
-        total += len(logs)
-        success += sum(1 for l in logs if l.get("completed"))
-        for l in logs:
-            if l.get("completed"):
-                continue
-            for raw in (l.get("failure_reason") or []):
-                labels.append(normalize_reason_category(raw))
-    c = Counter(labels)
-    ability_low = c["시간 부족"] + c["일정 충돌"] + c["과도한 목표 설정"]
-    motivation_low = c["의지 부족"]
-    ability = "low" if ability_low >= 2 else ("medium" if ability_low == 1 else "high")
-    motivation = "low" if motivation_low >= 2 else ("medium" if motivation_low == 1 else ("low" if rate < 30 else "high"))
-    if motivation == "low":
-        prompt = "spark"
-    elif ability == "low":
-        prompt = "facilitator"
-    else:
-        prompt = "signal"
-    return prompt
-
-
-def _generate_summary_bmap(nickname, habits, failure_data, rate):
-    """generate_report.py의 B=MAP 버전 summary 간략 이식"""
-    pt = _infer_overall_map_state(habits, rate)
+def _generate_summary_bmap(nickname, habits, failure_data, rate, stats=None):
+    """generate_report.py의 B=MAP 버전 summary 간략 이식 (stats: collect_stats(habits) 결과)"""
+    stats = stats if stats is not None else collect_stats(habits)
+    pt = infer_overall_map_state(habits, rate, stats["fail_labels"])["prompt_type"]
 
     consistency = (
         f"바쁜 기간 속에서 {rate:.1f}%나 해냈다는 건 {nickname}님의 꾸준함이 돋보입니다."
@@ -137,51 +184,36 @@ def _generate_summary_bmap(nickname, habits, failure_data, rate):
     )
 
     # 주요 실패 원인
-    all_reasons = []
+    # 한 번의 순회로 집계 후 최빈값 (동점이면 먼저 나온 사유 — most_common(1) 과 동일)
+    counts = {}
     for h in (failure_data or []):
         for r in h.get("reasons", []):
             if isinstance(r, dict) and r.get("reason"):
-                all_reasons.append(r["reason"])
-    if all_reasons:
-        most_common, _ = Counter(all_reasons).most_common(1)[0]
-        norm = normalize_reason_category(most_common)
+                counts[r["reason"]] = counts.get(r["reason"], 0) + 1
+    if counts:
+        most_common = max(counts, key=counts.get)
+        norm, icon = reason_icon(most_common)
         if norm == "기타 (직접 입력)":
-            icon = guess_emoji_from_text(most_common)
             failure_reasons = f"{icon} 직접 입력된 사유가 많았어요. 예: \"{most_common}\""
         else:
-            icon = REASON_ICON_MAP.get(norm, "💬")
             failure_reasons = f"가장 자주 등장한 방해 요인은 {icon} '{most_common}'이에요."
         if pt == "facilitator":
             failure_reasons += " → 이번 주는 '5분만/한 단계만'으로 가볍게 시작해봐요."
     else:
         failure_reasons = "이번 기간은 큰 방해 없이 잘 이어졌어요."
 
-    # 요일 패턴
-    weekday_success, weekday_total = Counter(), Counter()
-    for h in habits:
-        for log in h.get("habit_log", []):
-            try:
-                day = datetime.strptime(log["date"], "%Y-%m-%d").weekday()
-            except Exception:
-                continue
-            weekday_total[day] += 1
-            if log.get("completed"):
-                weekday_success[day] += 1
+    # 요일 패턴 (collect_stats 에서 함께 집계)
+    weekday_success, weekday_total = stats["weekday_success"], stats["weekday_total"]
     if weekday_total:
         rate_by_day = {d: weekday_success[d] / weekday_total[d] for d in weekday_total}
         best_day = max(rate_by_day, key=rate_by_day.get)
         worst_day = min(rate_by_day, key=rate_by_day.get)
-        days = ["월", "화", "수", "목", "금", "토", "일"]
-        daily_pattern = f"{days[best_day]}요일엔 리듬이 좋고, {days[worst_day]}요일엔 약간 느슨했어요."
+        daily_pattern = f"{WEEKDAY_NAMES[best_day]}요일엔 리듬이 좋고, {WEEKDAY_NAMES[worst_day]}요일엔 약간 느슨했어요."
     else:
         daily_pattern = "요일별 패턴을 확인할 데이터가 부족했어요."
 
     # 프롬프트 톤별 카피
-    courage = {
-        "spark": "작은 행동에도 마음이 움직입니다. 오늘의 1분이 내일의 루틴으로 이어질 거예요.",
-        "facilitator": "시작은 언제나 작을수록 좋아요. 부담 없이 한 걸음만 내딛어봐요.",
-        "signal": "지금 흐름이 아주 좋아요. 이 느낌 그대로 이어가면 충분합니다."
-    }[pt]
+    courage = COURAGE_BY_TONE[pt]
 
     return {
         "consistency": consistency,
@@ -192,8 +224,20 @@ def _generate_summary_bmap(nickname, habits, failure_data, rate):
 
 
 # ===================== 핵심 리포트 생성 함수 =====================
-def _generate_for_bundle(bundle: Dict[str, Any]) -> GenerateRunResponseItem:
-    """generate_report.py 로직 기반으로 즉시 리포트 생성 + B=MAP 반영"""
+def _bundle_from_payload(payload: UserPayload) -> Dict[str, Any]:
+    """검증된 요청 본문 -> _generate_for_bundle 입력 (집계 함수들이 dict 기반이므로 habits 만 한 번 변환)"""
+    return {
+        "user_id": payload.user_id,
+        "nickname": payload.nickname,
+        "type": payload.type,
+        "habits": [h.model_dump() for h in payload.habits],
+    }
+
+def _generate_for_bundle(bundle: Dict[str, Any], validated: bool = False) -> GenerateRunResponseItem:
+    """
+    generate_report.py 로직 기반으로 즉시 리포트 생성 + B=MAP 반영
+    - validated: user_id/nickname 이 이미 UserPayload 로 검증된 경우(True)에만 응답 항목 검증을 생략
+    """
     try:
         t = (bundle.get("type") or "monthly").lower()
         if t not in ("weekly", "monthly"):
@@ -203,26 +247,30 @@ def _generate_for_bundle(bundle: Dict[str, Any]) -> GenerateRunResponseItem:
         nickname = bundle.get("nickname", str(user_id))
         habits_all = _normalize_times_in_habits(bundle.get("habits", []))
 
-        active_habits = [h for h in minutes_filter_copy(habits_all) if h.get("habit_log")]
+        active_habits = select_active_habits(habits_all)
         if not active_habits:
             raise HTTPException(status_code=404, detail=f"{nickname}: 데이터 없음")
 
         parsed = {}
 
-        top_fail = compute_per_habit_top_failure_reasons(active_habits, topk=2)
-        rate = compute_overall_success_rate(active_habits)
-        level = consistency_level_from_rate(rate)
+        # 로그 집계는 collect_stats 한 번으로 (사유/지수/MAP/요일 패턴 공용)
+        stats = collect_stats(active_habits)
+        top_fail = compute_per_habit_top_failure_reasons(active_habits, 2, stats["fail_counts"])
+        rate = compute_overall_success_rate(active_habits, stats["per_habit"])
+        _, display_message = consistency_level_and_message(rate)
         parsed["consistency_index"] = {
             "success_rate": round(rate, 1),
-            "display_message": f"꾸준함 지수: {level}" +
-                               (" 🔥" if level == "높음" else (" 🙂" if level == "보통" else " 🌧️"))
+            "display_message": display_message
         }
 
         parsed["top_failure_reasons"] = top_fail
-        parsed["summary"] = _generate_summary_bmap(nickname, active_habits, top_fail, rate)
-        parsed["recommendation"] = generate_recommendations(active_habits)
+        parsed["summary"] = _generate_summary_bmap(nickname, active_habits, top_fail, rate, stats)
+        parsed["recommendation"] = generate_recommendations(active_habits, stats["per_habit"])
 
-        return GenerateRunResponseItem(user_id=user_id, nickname=nickname, type=t, **parsed)
+        if validated:
+            return GenerateRunResponseItem.model_construct(user_id=user_id, nickname=nickname, type=t, **parsed)
+        # data/ 파일은 검증 없이 읽으므로 여기서 검증 ("201" -> 201, nickname 이 문자열이 아니면 오류 항목)
+        return GenerateRunResponseItem.model_validate(dict(user_id=user_id, nickname=nickname, type=t, **parsed))
     except HTTPException:
         raise
     except Exception as e:
@@ -230,41 +278,95 @@ def _generate_for_bundle(bundle: Dict[str, Any]) -> GenerateRunResponseItem:
 
 
 # ===================== 엔드포인트 =====================
+# 헬스체크(라이브니스 프로브)용: 초 단위 'YYYY-MM-DDTHH:MM:SS' 는 같은 초 안에서 재사용
+_health_second = (-1, "")
+
 @app.get("/health")
-def health():
-    return {"status": "ok", "time": datetime.utcnow().isoformat() + "Z"}
+async def health():
+    global _health_second
+    sec, us = divmod(time.time_ns() // 1000, 1_000_000)
+    cached = _health_second
+    if cached[0] != sec:
+        cached = _health_second = (sec, time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(sec)))
+    # datetime.utcnow().isoformat() 과 같은 형식 (마이크로초가 0 이면 생략)
+    stamp = f"{cached[1]}.{us:06d}Z" if us else f"{cached[1]}Z"
+    return {"status": "ok", "time": stamp}
+
+# /reports/list 응답 캐시: (폴더 경로, 폴더 mtime_ns) -> 직렬화된 목록
+# 파일 추가/삭제/이름 변경 시 폴더 mtime 이 바뀌므로 그대로 ETag 로 사용
+_list_cache = (None, b"")
 
 @app.get("/reports/list")
-def list_reports():
+async def list_reports(if_none_match: Optional[str] = Header(None)):
+    global _list_cache
     if not os.path.isdir(INPUT_DIR):
         raise HTTPException(status_code=404, detail="data/ 폴더가 없습니다.")
-    files = [os.path.join(INPUT_DIR, f) for f in os.listdir(INPUT_DIR) if f.endswith(".json")]
-    return {"files": sorted(files)}
-
+    sig = (INPUT_DIR, os.stat(INPUT_DIR).st_mtime_ns)
+    etag = f'W/"{sig[1]:x}"'
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    cached_sig, body = _list_cache
+    if cached_sig != sig:
+        entries = await asyncio.to_thread(scan_json_files, INPUT_DIR)
+        body = orjson.dumps({"files": sorted(e.path for e in entries)})
+        _list_cache = (sig, body)
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+# response_model 은 문서(OpenAPI)용 — 응답은 Response 로 직접 반환해 출력 재검증을 건너뜀
 @app.post("/reports/run", response_model=GenerateRunResponse)
-def run_from_data():
+async def run_from_data():
     if not os.path.isdir(INPUT_DIR):
         raise HTTPException(status_code=404, detail="data/ 폴더가 없습니다.")
-    results: List[GenerateRunResponseItem] = []
-    any_found = False
-    for filename in os.listdir(INPUT_DIR):
-        if not filename.endswith(".json"): continue
-        any_found = True
-        path = os.path.join(INPUT_DIR, filename)
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                bundle = json.load(f)
-            results.append(_generate_for_bundle(bundle))
-        except Exception as e:
-            results.append(GenerateRunResponseItem(
-                user_id=-1, nickname=filename, type="unknown",
-                top_failure_reasons=[], consistency_index={},
-                summary={}, recommendation=[], error=str(e)
-            ))
-    if not any_found:
+    entries = await asyncio.to_thread(scan_json_files, INPUT_DIR)
+    if not entries:
         raise HTTPException(status_code=404, detail="data/ 폴더에 JSON 파일이 없습니다.")
-    return GenerateRunResponse(results=results)
+
+    # 사라진 파일의 캐시 항목 정리
+    live = {e.path for e in entries}
+    with _payload_cache_lock:
+        for stale in [p for p in _payload_cache if p not in live]:
+            del _payload_cache[stale]
+
+    # 파일 읽기 + 파싱은 스레드풀에서 겹쳐 실행 (제출한 작업은 풀 종료 후에도 끝까지 수행)
+    pool = ThreadPoolExecutor(max_workers=min(32, len(entries)))
+    futures = [pool.submit(_load_one, e.path) for e in entries]
+    pool.shutdown(wait=False)
+
+    # 리포트는 파일 순서대로 생성하며 하나씩 바로 내보냄 — 전체 결과를 메모리에 모으지 않음
+    # 응답 형태는 그대로 {"results": [...]} (동기 제너레이터라 Starlette 가 스레드풀에서 순회)
+    def _render(entry, future):
+        bundle, err = future.result()
+        item = _error_item(entry.name, err) if err is not None else _generate_for_bundle(bundle)
+        return _ITEM_ADAPTER.dump_json(item)
+
+    def _stream():
+        yield b'{"results":['
+        for i, (entry, future) in enumerate(zip(entries, futures)):
+            # 200 과 앞부분이 이미 나갔으므로 어떤 실패든 오류 항목으로 바꿔 JSON 문서를 항상 완결
+            try:
+                chunk = _render(entry, future)
+            except Exception as e:
+                chunk = _ITEM_ADAPTER.dump_json(_error_item(entry.name, str(e)))
+            if i:
+                yield b","
+            yield chunk
+        yield b"]}"
+
+    return StreamingResponse(_stream(), media_type="application/json")
 
 @app.post("/reports/generate", response_model=GenerateRunResponseItem)
-def generate_from_body(payload: UserPayload):
-    return _generate_for_bundle(payload.dict())
\ No newline at end of file
+async def generate_from_body(payload: UserPayload):
+    # 같은 본문이면 결과도 같으므로 본문 해시로 서버 쪽 LRU 만 사용 (POST 라 ETag/304 는 쓰지 않음)
+    key = _payload_key(payload)
+    with _generate_cache_lock:
+        body = _generate_cache.get(key)
+        if body is not None:
+            _generate_cache.move_to_end(key)
+    if body is None:
+        # 캐시 미스일 때만 CPU 작업(리포트 생성 + 직렬화)을 스레드로 넘김 — 캐시 적중은 이벤트 루프에서 바로 응답
+        body = await asyncio.to_thread(lambda: _ITEM_ADAPTER.dump_json(_generate_for_bundle(_bundle_from_payload(payload), validated=True)))
+        with _generate_cache_lock:
+            _generate_cache[key] = body
+            if len(_generate_cache) > GENERATE_CACHE_SIZE:
+                _generate_cache.popitem(last=False)
+    return Response(content=body, media_type="application/json")
\ No newline at end of file